@@ -1,17 +1,351 @@
-import requests
-import json
+import asyncio
+import codecs
+import contextlib
+import hashlib
+import marshal
 import os
+import struct
 import subprocess
-import tempfile
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import httpx
+import orjson
 from dotenv import load_dotenv
 
+# Status codes worth a quick retry: rate limits and temporary server errors.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# The little program that runs inside the worker interpreter. It reads
+# length-prefixed jobs from stdin, runs each script with its prints
+# captured, and writes back (returncode, stdout, stderr). Jobs are either
+#   ("load_and_run", digest, code, source, filename) the first time, or
+#   ("run", digest, filename) once the worker already holds that code.
+# Compiled scripts are kept by digest, in the same LRU order the agent
+# keeps them, and their source goes into linecache for readable tracebacks.
+WORKER_SRC = r"""
+import contextlib, io, linecache, marshal, os, struct, sys, traceback
+from collections import OrderedDict
+
+max_compiled = int(sys.argv[1])
+compiled = OrderedDict()
+
+# Keep private copies of the pipes for our messages, and point the real
+# stdin/stdout at nothing so a script can't scramble the conversation.
+jobs_in = os.fdopen(os.dup(0), 'rb')
+results_out = os.fdopen(os.dup(1), 'wb')
+devnull = os.open(os.devnull, os.O_RDWR)
+os.dup2(devnull, 0)
+os.dup2(devnull, 1)
+
+def read_exactly(size):
+    data = b''
+    while len(data) < size:
+        chunk = jobs_in.read(size - len(data))
+        if not chunk:
+            sys.exit(0)
+        data += chunk
+    return data
+
+while True:
+    size, = struct.unpack('>I', read_exactly(4))
+    job = marshal.loads(read_exactly(size))
+    if job[0] == 'run':
+        kind, digest, filename = job
+        code = compiled[digest][0]
+        compiled.move_to_end(digest)
+    else:
+        kind, digest, code, source, filename = job
+        compiled[digest] = (code, filename)
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        if len(compiled) > max_compiled:
+            _, (_, old_filename) = compiled.popitem(last=False)
+            if all(name != old_filename for _, name in compiled.values()):
+                linecache.cache.pop(old_filename, None)
+    out, err = io.StringIO(), io.StringIO()
+    returncode = 0
+    # Scripts share this interpreter, so put back the things they most often
+    # change (working folder, environment variables, argv) after each one.
+    saved_cwd, saved_env, saved_argv = os.getcwd(), dict(os.environ), sys.argv
+    # Jobs come from URLs, so there is no script folder to add to sys.path;
+    # argv[0] is the URL, the same name tracebacks and __file__ use.
+    sys.argv = [filename]
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            exec(code, {'__name__': '__main__', '__file__': filename})
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                returncode = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException as e:
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+            returncode = 1
+        finally:
+            os.chdir(saved_cwd)
+            if os.environ != saved_env:
+                os.environ.clear()
+                os.environ.update(saved_env)
+            sys.argv = saved_argv
+    reply = marshal.dumps((returncode, out.getvalue(), err.getvalue()))
+    results_out.write(struct.pack('>I', len(reply)) + reply)
+    results_out.flush()
+"""
+
+
+class ScriptWorker:
+    """
+    A Python interpreter that stays running between scripts, so we don't pay
+    the start-up cost (a fresh process, site.py, imports) for every run.
+    It is replaced after max_tasks scripts to keep its memory in check.
+    """
+
+    def __init__(self, env=None, max_tasks=100, max_compiled=64):
+        self.env = env
+        self.max_tasks = max_tasks
+        self.max_compiled = max_compiled
+        self._proc = None
+        self._tasks = 0
+        self._known = OrderedDict()
+
+    async def start(self):
+        # Use the same interpreter as the agent so scripts see the same packages.
+        self._proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-X', 'utf8', '-u', '-c', WORKER_SRC, str(self.max_compiled),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=self.env
+        )
+        self._tasks = 0
+        self._known.clear()
+
+    async def _ensure_running(self):
+        if self._proc is None or self._proc.returncode is not None or self._tasks >= self.max_tasks:
+            await self.close()
+            await self.start()
+        self._tasks += 1
+
+    async def send_compiled(self, digest, code, source, filename, timeout=30):
+        """
+        Run one compiled script in the worker and return (returncode, stdout,
+        stderr). The code object and its source only cross the pipe the first
+        time; after that the digest is enough.
+        Raises subprocess.TimeoutExpired if it takes longer than timeout.
+        """
+        await self._ensure_running()
+        if digest in self._known:
+            self._known.move_to_end(digest)
+            job = ("run", digest, filename)
+        else:
+            self._known[digest] = True
+            if len(self._known) > self.max_compiled:
+                self._known.popitem(last=False)
+            job = ("load_and_run", digest, code, source, filename)
+        return await self._submit(marshal.dumps(job), filename, timeout)
+
+    async def _exchange(self, message):
+        self._proc.stdin.write(struct.pack('>I', len(message)) + message)
+        await self._proc.stdin.drain()
+        size, = struct.unpack('>I', await self._proc.stdout.readexactly(4))
+        return marshal.loads(await self._proc.stdout.readexactly(size))
+
+    async def _submit(self, message, filename, timeout):
+        try:
+            return await asyncio.wait_for(self._exchange(message), timeout)
+        except asyncio.TimeoutError:
+            # The script is stuck; the only way to stop it is a new worker.
+            await self.close()
+            raise subprocess.TimeoutExpired(filename, timeout)
+        except (OSError, EOFError, ValueError):
+            if self._proc.returncode is None:
+                self._proc.kill()
+            returncode = await self._proc.wait()
+            self._proc = None
+            # A worker that quit cleanly still failed to answer, so never report 0.
+            return returncode or 1, "", "Error: The script stopped the Python worker unexpectedly."
+
+    async def close(self):
+        if self._proc is not None:
+            if self._proc.returncode is None:
+                self._proc.kill()
+            await self._proc.wait()
+            self._proc = None
+
+
+class ScriptPool:
+    """
+    A few ScriptWorkers sharing the work, so several scripts can run side by
+    side. Workers are started only when needed, and at most `size` scripts
+    run at the same time; the rest wait for a free worker.
+    """
+
+    def __init__(self, size=4, **worker_options):
+        self.size = size
+        self._worker_options = worker_options
+        self._workers = []
+        self._idle = None
+
+    @property
+    def max_compiled(self):
+        return self._worker_options.get('max_compiled', 64)
+
+    async def _acquire(self):
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and len(self._workers) < self.size:
+            worker = ScriptWorker(**self._worker_options)
+            self._workers.append(worker)
+            return worker
+        return await self._idle.get()
+
+    async def start(self):
+        """
+        Warm up one worker so the first script doesn't wait for it.
+        """
+        worker = await self._acquire()
+        await worker.start()
+        self._idle.put_nowait(worker)
+
+    async def send_compiled(self, digest, code, source, filename, timeout=30):
+        worker = await self._acquire()
+        try:
+            return await worker.send_compiled(digest, code, source, filename, timeout)
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def close(self):
+        for worker in self._workers:
+            await worker.close()
+
+
+class ResponseCache:
+    """
+    A small memory for answers we've already paid for. If the exact same
+    conversation is sent again, we reuse the old reply instead of asking
+    the AI (and waiting, and paying) a second time.
+    """
+
+    def __init__(self, enabled=True, ttl_seconds=3600, max_entries=256):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Oldest-used first, so the least recently used reply goes when full.
+        self._entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def make_key(model, messages_json, temperature):
+        """
+        Turn a request into a short fingerprint. Same request, same key.
+        messages_json is the already-serialized messages list, so long
+        histories are hashed as-is rather than encoded all over again.
+        """
+        settings = orjson.dumps({"model": model, "temperature": temperature}, option=orjson.OPT_SORT_KEYS)
+        return hashlib.sha256(settings + b"\n" + bytes(messages_json)).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a saved reply. Returns None when there isn't a fresh one.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            saved_at, text = entry
+            if self.ttl_seconds is None or time.monotonic() - saved_at < self.ttl_seconds:
+                self.stats["hits"] += 1
+                self._entries.move_to_end(key)
+                return text
+            del self._entries[key]
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key, text):
+        self._entries[key] = (time.monotonic(), text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SemanticCache:
+    """
+    A fuzzier memory: it remembers what questions *mean* (as embedding
+    vectors) so "capital of France?" can reuse the answer we already got
+    for "What is France's capital?".
+    numpy is only needed here, so it is imported when the cache is built.
+    """
+
+    def __init__(self, threshold=0.92, ttl_seconds=3600, max_entries=256):
+        # Check for numpy now, at setup, rather than halfway through a turn.
+        try:
+            import numpy
+        except ImportError:
+            raise ValueError("semantic_cache=True needs numpy. Install it with: pip install numpy") from None
+        self._np = numpy
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.vecs = None
+        self.responses = []
+        self.timestamps = []
+        self.stats = {"hits": 0, "misses": 0}
+
+    def normalize(self, vector):
+        vec = self._np.asarray(vector, dtype=self._np.float32)
+        return vec / (self._np.linalg.norm(vec) or 1.0)
+
+    def _drop(self, row):
+        self.vecs = self._np.delete(self.vecs, row, axis=0)
+        del self.responses[row]
+        del self.timestamps[row]
+
+    def get(self, query_vec):
+        """
+        Return the saved reply whose question is most similar to this one,
+        or None when nothing is close enough.
+        """
+        if self.ttl_seconds is not None and self.responses:
+            now = time.monotonic()
+            for row in reversed(range(len(self.timestamps))):
+                if now - self.timestamps[row] >= self.ttl_seconds:
+                    self._drop(row)
+
+        if self.responses:
+            sims = self.vecs @ query_vec
+            best = int(sims.argmax())
+            if sims[best] >= self.threshold:
+                self.timestamps[best] = time.monotonic()
+                self.stats["hits"] += 1
+                return self.responses[best]
+        self.stats["misses"] += 1
+        return None
+
+    def add(self, query_vec, text):
+        """
+        Remember a new question/answer pair, forgetting the least recently
+        used one when we're full.
+        """
+        np = self._np
+        if len(self.responses) >= self.max_entries:
+            self._drop(int(np.argmin(self.timestamps)))
+        row = query_vec[np.newaxis, :]
+        self.vecs = row if self.vecs is None else np.vstack([self.vecs, row])
+        self.responses.append(text)
+        self.timestamps.append(time.monotonic())
+
+
 class PythonAgent:
     """
     This is the blueprint for our robot helper. It holds all the skills
     and properties of the agent.
     """
 
-    def __init__(self, api_url, api_key, system_prompt, model="gpt-3.5-turbo"):
+    def __init__(self, api_url, api_key, system_prompt, model="gpt-3.5-turbo", temperature=0.7,
+                 cache_enabled=True, cache_ttl_seconds=3600, semantic_cache=False,
+                 embedding_model="text-embedding-3-small", max_recent_turns=10, summarize_every=5):
         """
         The 'setup' recipe that runs when we build a new robot.
         It sets the agent's personality and tools.
@@ -22,165 +356,552 @@ class PythonAgent:
         self.api_key = api_key
         self.system_prompt = system_prompt
         self.model = model
+        self.temperature = temperature
+        # The first message never changes. OpenAI caches the start of a
+        # request when it is byte-for-byte the same as before, which makes
+        # those tokens cheaper and faster (see "Saving Time and Money").
         self.conversation_history = [{"role": "system", "content": self.system_prompt}]
 
-    def _execute_local_script(self, file_path):
+        # The same history, already turned into JSON (the inside of the
+        # "messages" list). New messages are added to the end, so each turn
+        # only encodes its own message instead of the whole chat again.
+        self._messages_bytes = bytearray()
+        self._messages_count = 0
+        self._rebuild_messages_bytes()
+
+        # Every turn re-sends the whole history, so a long chat gets slower and
+        # pricier with each message. We keep only the last few turns word for
+        # word and fold older ones into a short running summary, which lives
+        # in its own message right after the system prompt.
+        self.max_recent_turns = max_recent_turns
+        self.summarize_every = summarize_every
+        self._summary = ""
+        self._has_summary_msg = False
+        # Summaries are written in the background while the user reads the
+        # reply; the next turn waits for this task before touching the history.
+        self._summary_task = None
+
+        # One long-lived client per host keeps the TCP+TLS connection open
+        # between turns instead of doing a new handshake for every message.
+        # HTTP/2 lets several requests share that one connection at once, and
+        # its header compression sends the long Authorization header in full
+        # only once. GitHub gets its own client so our API key is never sent there.
+        self._http = httpx.AsyncClient(
+            http2=True,
+            headers={
+                'Authorization': f'Bearer {self.api_key}',
+                'Content-Type': 'application/json'
+            },
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=10)
+        )
+        # Renamed or moved repos answer with a redirect, so follow it like a
+        # browser would. Conditional-GET details stay keyed on the URL we were given.
+        self._github_http = httpx.AsyncClient(http2=True, timeout=10.0, follow_redirects=True,
+                                              limits=httpx.Limits(max_keepalive_connections=4))
+
+        # Scripts get our environment plus settings that force UTF-8 output.
+        # It never changes, so it's built once here rather than per script.
+        self._child_env = {**os.environ, 'PYTHONIOENCODING': 'utf-8', 'PYTHONUTF8': '1'}
+
+        # The script runners; one is started when the chat starts, so the
+        # first run_local/run_github is quick too.
+        self._worker = ScriptPool(env=self._child_env)
+
+        # Chat commands: the first word of the input picks the handler.
+        self._cmds = {
+            "run_local": lambda file_path: self._execute_local_script(file_path, on_output=self._print_output),
+            "run_github": self._run_github_command
+        }
+
+        # Compiled GitHub scripts, keyed by a hash of their source, so a
+        # script we've seen before is never parsed again.
+        self._compiled = OrderedDict()
+        self._max_compiled = self._worker.max_compiled
+
+        # url -> (etag, last_modified, text, digest) for conditional GETs.
+        self._http_cache = {}
+
+        # Replies are only reused when temperature is 0, because that's the
+        # only time the AI is expected to give the same answer twice.
+        self._cache = ResponseCache(enabled=cache_enabled, ttl_seconds=cache_ttl_seconds)
+
+        # The semantic cache is opt-in: it costs one cheap embeddings call per
+        # message and answers paraphrases without looking at earlier turns.
+        # Like the exact cache it only works at temperature 0, so asking for
+        # it with any other temperature is a setup mistake, not a no-op.
+        if semantic_cache and temperature != 0:
+            raise ValueError("semantic_cache=True only works with temperature=0.")
+        self.embedding_model = embedding_model
+        self.embeddings_url = api_url.rsplit('/chat/completions', 1)[0] + '/embeddings'
+        self._semantic_cache = SemanticCache(ttl_seconds=cache_ttl_seconds) if semantic_cache else None
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def _request(client, method, url, timeout, retries=2, **kwargs):
+        """
+        Send a request, quietly retrying short hiccups (rate limits, server
+        errors, failed connects) a couple of times with a small backoff.
+        The timeout applies to connecting and to each read, not the whole
+        reply, so a long streamed answer isn't cut off.
+        Use it with `async with`; the body is read inside the block.
+        """
+        request = client.build_request(method, url, timeout=timeout, **kwargs)
+        for attempt in range(retries + 1):
+            try:
+                response = await client.send(request, stream=True)
+            except httpx.ConnectError:
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    break
+                await response.aclose()
+            await asyncio.sleep(0.2 * 2 ** attempt)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    @staticmethod
+    async def _run_with_timeout(fn, on_request_err, on_timeout=None, on_error="An error occurred"):
+        """
+        The one place where things going wrong turn into friendly messages.
+        Awaits fn() and returns (result, None), or (None, message) if it
+        timed out or failed. on_timeout is for network timeouts; a script
+        that runs too long always gets the same time-limit message.
+        """
+        try:
+            return await fn(), None
+        except subprocess.TimeoutExpired:
+            return None, "Error: Script execution timed out (30 seconds limit)."
+        except httpx.TimeoutException:
+            return None, on_timeout
+        except httpx.HTTPError as e:
+            return None, f"{on_request_err}: {e}"
+        except Exception as e:
+            return None, f"{on_error}: {e}"
+
+    @staticmethod
+    def _format_script_result(returncode, stdout, stderr):
+        if returncode == 0:
+            return f"--- Script Result ---\n{stdout}"
+        else:
+            return f"--- Script Error ---\n{stderr}"
+
+    @staticmethod
+    def _print_output(text):
+        print(text, end="", flush=True)
+
+    async def _execute_local_script(self, file_path, on_output=None):
         """
         Execute a Python script from the local file system.
+        If on_output is given, the script's output is handed to it while the
+        script is still running, and isn't repeated in the result.
         """
         print(f"--- Action: Executing local script: {file_path} ---")
+        result, error = await self._run_with_timeout(
+            lambda: self._local_script_result(file_path, on_output),
+            on_request_err="Error running script"
+        )
+        return result if error is None else error
+
+    async def _local_script_result(self, file_path, on_output, timeout=30):
+        # Catch a mistyped path early with a friendly message; otherwise the
+        # child interpreter would only report it on stderr. The child opens
+        # and reads the file itself, so one stat is all this check costs.
+        if not os.path.exists(file_path):
+            return f"Error: File '{file_path}' not found."
+
+        # A fresh, unbuffered (-u) interpreter whose output we read as it is
+        # written, so long or chatty scripts show their progress right away.
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, '-X', 'utf8', '-u', file_path,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self._child_env
+        )
+
+        async def collect_stdout():
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            pieces = []
+            while True:
+                chunk = await process.stdout.read(4096)
+                text = decoder.decode(chunk, final=not chunk)
+                if text:
+                    pieces.append(text)
+                    if on_output is not None:
+                        on_output(text)
+                if not chunk:
+                    return "".join(pieces)
+
         try:
-            if not os.path.exists(file_path):
-                return f"Error: File '{file_path}' not found."
-            
-            # Set environment variables to force UTF-8 encoding
-            env = os.environ.copy()
-            env['PYTHONIOENCODING'] = 'utf-8'
-            env['PYTHONUTF8'] = '1'
-            
-            process = subprocess.run(
-                ['python', '-X', 'utf8', file_path],
-                capture_output=True, 
-                text=True, 
-                timeout=30,
-                env=env
+            stdout, stderr, returncode = await asyncio.wait_for(
+                asyncio.gather(collect_stdout(), process.stderr.read(), process.wait()),
+                timeout
             )
-            
-            if process.returncode == 0:
-                return f"--- Script Result ---\n{process.stdout}"
-            else:
-                return f"--- Script Error ---\n{process.stderr}"
-                
-        except subprocess.TimeoutExpired:
-            return "Error: Script execution timed out (30 seconds limit)."
-        except Exception as e:
-            return f"An error occurred: {e}"
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise subprocess.TimeoutExpired(file_path, timeout)
+
+        if on_output is not None and returncode == 0:
+            return "--- Script Finished ---"
+        return self._format_script_result(returncode, stdout, stderr.decode('utf-8', errors='replace'))
 
-    def _execute_github_script(self, github_raw_url):
+    async def _execute_github_script(self, github_raw_url):
         """
         The 'how to do things' recipe. It runs code from a GitHub link.
         Fixed to handle encoding issues properly.
         """
         print(f"--- Action: Executing script from: {github_raw_url} ---")
-        try:
-            # Check if URL is a raw GitHub URL
-            if "raw.githubusercontent.com" not in github_raw_url:
-                return "Error: Please use a raw GitHub URL (raw.githubusercontent.com). Regular GitHub URLs won't work."
-            
-            response = requests.get(github_raw_url, timeout=10)
-            response.raise_for_status()
-            script_code = response.text
-            
-            # Create temporary file with UTF-8 encoding
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as temp_script:
-                temp_script.write(script_code)
-                temp_script_path = temp_script.name
-                
-            # Execute the script with proper encoding handling
-            # Set multiple environment variables to force UTF-8 encoding on Windows
-            env = os.environ.copy()
-            env['PYTHONIOENCODING'] = 'utf-8'
-            env['PYTHONUTF8'] = '1'
-            
-            process = subprocess.run(
-                ['python', '-X', 'utf8', temp_script_path],
-                capture_output=True, 
-                text=True, 
-                timeout=30,
-                env=env
-            )
-            
-            # Clean up temporary file
-            os.remove(temp_script_path)
-            
-            if process.returncode == 0:
-                return f"--- Script Result ---\n{process.stdout}"
+        # Check if URL is a raw GitHub URL
+        if "raw.githubusercontent.com" not in github_raw_url:
+            return "Error: Please use a raw GitHub URL (raw.githubusercontent.com). Regular GitHub URLs won't work."
+
+        result, error = await self._run_with_timeout(
+            lambda: self._github_script_result(github_raw_url),
+            on_timeout="Error: Request timed out. Check your internet connection.",
+            on_request_err="Error fetching script"
+        )
+        return result if error is None else error
+
+    async def _github_script_result(self, github_raw_url):
+        # Ask GitHub to skip the download if the file hasn't changed
+        # since last time (it answers "304 Not Modified" with no body).
+        headers = {}
+        cached = self._http_cache.get(github_raw_url)
+        if cached is not None:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        async with self._request(self._github_http, 'GET', github_raw_url, timeout=10, headers=headers) as response:
+            if response.status_code == 304 and cached is not None:
+                _, _, script_code, digest = cached
             else:
-                return f"--- Script Error ---\n{process.stderr}"
-                
-        except requests.exceptions.Timeout:
-            return "Error: Request timed out. Check your internet connection."
-        except requests.exceptions.RequestException as e:
-            return f"Error fetching script: {e}"
-        except subprocess.TimeoutExpired:
-            return "Error: Script execution timed out (30 seconds limit)."
-        except Exception as e:
-            return f"An error occurred: {e}"
+                response.raise_for_status()
+                await response.aread()
+                script_code = response.text
+                digest = hashlib.sha256(script_code.encode('utf-8')).hexdigest()
+                etag = response.headers.get('ETag')
+                last_modified = response.headers.get('Last-Modified')
+                if etag or last_modified:
+                    self._http_cache[github_raw_url] = (etag, last_modified, script_code, digest)
+
+        code = self._compiled.get(digest)
+        if code is None:
+            try:
+                code = compile(script_code, github_raw_url, 'exec')
+            except SyntaxError as e:
+                return "--- Script Error ---\n" + "".join(traceback.format_exception_only(type(e), e))
+            self._compiled[digest] = code
+            if len(self._compiled) > self._max_compiled:
+                self._compiled.popitem(last=False)
+        else:
+            self._compiled.move_to_end(digest)
+
+        # The script goes straight to the worker; nothing touches the disk.
+        # For an unchanged script (304, digest already known) this is just a
+        # lookup and a tiny message: no download, no hashing, no compiling.
+        return self._format_script_result(*await self._worker.send_compiled(digest, code, script_code, github_raw_url))
 
-    def _get_agent_response(self, prompt):
+    async def _run_github_command(self, urls):
         """
-        The 'how to chat' recipe. This is now configured for OpenAI's API.
+        Handle `run_github <url> [<url> ...]`. Several URLs are downloaded
+        and run at the same time, and the results come back in order.
         """
-        self.conversation_history.append({"role": "user", "content": prompt})
-        payload = { 
-            "model": self.model, 
-            "messages": self.conversation_history,
-            "max_tokens": 1000,
-            "temperature": 0.7
-        }
-        headers = { 
-            'Authorization': f'Bearer {self.api_key}', 
-            'Content-Type': 'application/json' 
-        }
+        url_list = urls.split()
+        if len(url_list) == 1:
+            return await self._execute_github_script(url_list[0])
+        results = await asyncio.gather(*(self._execute_github_script(url) for url in url_list))
+        return "\n".join(f"[{url}]\n{result}" for url, result in zip(url_list, results))
+
+    async def _embed(self, text):
+        """
+        Ask OpenAI for the meaning-vector of a piece of text (unit length).
+        Returns None if it couldn't be fetched; the chat carries on without it.
+        """
+        try:
+            body = orjson.dumps({"model": self.embedding_model, "input": text})
+            async with self._request(self._http, 'POST', self.embeddings_url, timeout=10, content=body) as response:
+                response.raise_for_status()
+                result = orjson.loads(await response.aread())
+            return self._semantic_cache.normalize(result['data'][0]['embedding'])
+        except (httpx.HTTPError, KeyError, IndexError, ValueError):
+            return None
+
+    @staticmethod
+    async def _read_stream(response, on_token=None):
+        """
+        Collect a streamed (server-sent events) reply piece by piece,
+        handing each piece to on_token as soon as it arrives.
+        """
+        pieces = []
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):].strip()
+            if data == "[DONE]":
+                break
+            chunk = orjson.loads(data)
+            if not chunk.get('choices'):
+                continue
+            token = chunk['choices'][0]['delta'].get('content') or ""
+            if token:
+                pieces.append(token)
+                if on_token is not None:
+                    on_token(token)
+        return "".join(pieces)
+
+    def _rebuild_messages_bytes(self):
+        """
+        Encode the whole history from scratch. Only needed when old turns
+        are removed or the summary changes.
+        """
+        self._messages_bytes = bytearray(b",".join(orjson.dumps(msg) for msg in self.conversation_history))
+        self._messages_count = len(self.conversation_history)
+
+    def _append_message(self, role, content):
+        """
+        Add a message to the history and to its JSON copy. Returns where the
+        message starts in the JSON copy, so it can be cut off again.
+        """
+        message = {"role": role, "content": content}
+        if self._messages_count != len(self.conversation_history):
+            # Someone changed the history behind our back; start over.
+            self._rebuild_messages_bytes()
+        self.conversation_history.append(message)
+        start = len(self._messages_bytes)
+        if self._messages_bytes:
+            self._messages_bytes += b","
+        self._messages_bytes += orjson.dumps(message)
+        self._messages_count += 1
+        return start
+
+    def _request_body(self):
+        """
+        Build the JSON body for a chat request around the pre-encoded history.
+        """
+        if self._messages_count != len(self.conversation_history):
+            self._rebuild_messages_bytes()
+        return b"".join((
+            b'{"model":', orjson.dumps(self.model),
+            b',"messages":[', self._messages_bytes,
+            b'],"max_tokens":1000,"temperature":', orjson.dumps(self.temperature),
+            b',"stream":true}'
+        ))
+
+    async def _add_assistant_reply(self, text):
+        """
+        Save the AI's reply in the history, then make room once we're over
+        max_recent_turns. Old turns are dropped summarize_every at a time, so
+        the start of the history stays the same for several turns in a row.
+        """
+        self._append_message("assistant", text)
+        first_turn = 2 if self._has_summary_msg else 1
+        extra_messages = len(self.conversation_history) - first_turn - 2 * self.max_recent_turns
+        if extra_messages > 0:
+            drop = max(extra_messages, 2 * self.summarize_every)
+            drop = min(drop, len(self.conversation_history) - first_turn - 2)
+            old_messages = self.conversation_history[first_turn:first_turn + drop]
+            del self.conversation_history[first_turn:first_turn + drop]
+            self._summary_task = asyncio.create_task(self._update_summary(old_messages))
+
+    async def _finish_summary(self):
+        """
+        Wait for the summary started by the previous turn, if it is still
+        being written, so the history is settled before we add to it.
+        """
+        task, self._summary_task = self._summary_task, None
+        if task is not None:
+            await task
 
+    async def _update_summary(self, old_messages):
+        """
+        Squeeze the dropped turns into the running summary with one small,
+        non-streamed request. If that fails we simply keep the tail of the
+        raw text instead.
+        """
+        old_turns = "\n".join(f"{msg['role'].title()}: {msg['content']}" for msg in old_messages)
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "Summarize this conversation in a few sentences. Keep names, facts and decisions."},
+                {"role": "user", "content": f"Summary so far: {self._summary}\n\nNew turns:\n{old_turns}"}
+            ],
+            "max_tokens": 300,
+            "temperature": 0
+        }
         try:
-            response = requests.post(self.api_url, headers=headers, data=json.dumps(payload), timeout=30)
+            async with self._request(self._http, 'POST', self.api_url, timeout=30, content=orjson.dumps(payload)) as response:
+                response.raise_for_status()
+                result = orjson.loads(await response.aread())
+            new_summary = result['choices'][0]['message']['content'].strip()
+        except (httpx.HTTPError, KeyError, IndexError, ValueError, AttributeError):
+            new_summary = ""
+        if not new_summary:
+            new_summary = f"{self._summary}\n{old_turns}".strip()[-2000:]
+
+        summary_msg = {"role": "system", "content": "Prior conversation summary: " + new_summary}
+        if self._has_summary_msg:
+            self.conversation_history[1] = summary_msg
+        else:
+            self.conversation_history.insert(1, summary_msg)
+            self._has_summary_msg = True
+        self._summary = new_summary
+        self._rebuild_messages_bytes()
+
+    async def _get_agent_response(self, prompt, on_token=None):
+        """
+        The 'how to chat' recipe. This is now configured for OpenAI's API.
+        The reply is streamed: if on_token is given, it gets called with
+        each piece of text the moment it arrives.
+        """
+        await self._finish_summary()
+        rollback_size = self._append_message("user", prompt)
+
+        cache_key = None
+        if self._cache.enabled and self.temperature == 0:
+            cache_key = ResponseCache.make_key(self.model, self._messages_bytes, self.temperature)
+            cached_text = self._cache.get(cache_key)
+            if cached_text is not None:
+                await self._add_assistant_reply(cached_text)
+                return cached_text
+
+        query_vec = None
+        if self._semantic_cache is not None and self.temperature == 0:
+            query_vec = await self._embed(prompt)
+            if query_vec is not None:
+                similar_text = self._semantic_cache.get(query_vec)
+                if similar_text is not None:
+                    await self._add_assistant_reply(similar_text)
+                    return similar_text
+
+        body = self._request_body()
+        agent_text, error = await self._run_with_timeout(
+            lambda: self._stream_reply(body, on_token),
+            on_timeout="Error: Request to AI timed out. Please try again.",
+            on_request_err="Error talking to the AI brain",
+            on_error="Error talking to the AI brain"
+        )
+        if error is None and not agent_text:
+            error = "Error: The AI's response was empty."
+        if error is not None:
+            # Forget the question too, so the history stays in user/assistant pairs.
+            self.conversation_history.pop()
+            del self._messages_bytes[rollback_size:]
+            self._messages_count -= 1
+            return error
+
+        await self._add_assistant_reply(agent_text)
+        if cache_key is not None:
+            self._cache.set(cache_key, agent_text)
+        if query_vec is not None:
+            self._semantic_cache.add(query_vec, agent_text)
+        return agent_text
+
+    async def _stream_reply(self, body, on_token):
+        async with self._request(self._http, 'POST', self.api_url, timeout=30, content=body) as response:
             response.raise_for_status()
-            result = response.json()
-            agent_text = result['choices'][0]['message']['content']
-            if agent_text:
-                self.conversation_history.append({"role": "assistant", "content": agent_text})
-                return agent_text
+            return await self._read_stream(response, on_token)
+
+    async def close(self):
+        """
+        Tidy up: stop the script worker and close our network connections.
+        """
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._summary_task
+            self._summary_task = None
+        await self._worker.close()
+        await self._http.aclose()
+        await self._github_http.aclose()
+
+    @staticmethod
+    async def _read_input(prompt):
+        """
+        Wait for the user's next line without blocking the event loop.
+        input() runs in a daemon thread so Ctrl+C can still end the program
+        while it is waiting.
+        """
+        loop = asyncio.get_running_loop()
+        line = loop.create_future()
+
+        def deliver(setter, value):
+            if not line.done():
+                setter(value)
+
+        def read_line():
+            try:
+                text = input(prompt)
+            except BaseException as e:
+                loop.call_soon_threadsafe(deliver, line.set_exception, e)
             else:
-                self.conversation_history.pop()
-                return "Error: The AI's response was empty."
-        except requests.exceptions.Timeout:
-            self.conversation_history.pop()
-            return "Error: Request to AI timed out. Please try again."
-        except requests.exceptions.RequestException as e:
-            self.conversation_history.pop()
-            return f"Error talking to the AI brain: {e}"
-        except Exception as e:
-            self.conversation_history.pop()
-            return f"Error talking to the AI brain: {e}"
+                loop.call_soon_threadsafe(deliver, line.set_result, text)
+
+        threading.Thread(target=read_line, daemon=True).start()
+        return await line
 
-    def start_chat(self):
+    async def start_chat(self):
         """
         This function starts the conversation and listens for user input.
         """
+        await self._worker.start()
+
         print("--- Your Python Agent is Ready (Using ChatGPT) ---")
         print("Commands:")
         print("  run_local <file_path>     - Run a Python script from your computer")
         print("  run_github <raw_url>      - Run a Python script from GitHub")
+        print("                              (give several URLs to run them in parallel)")
         print("  Type 'quit' or 'exit' to end.")
         print("  Remember: Use raw.githubusercontent.com URLs for GitHub!")
         print("-" * 60)
 
+        try:
+            await self._chat_loop()
+        finally:
+            await self.close()
+
+    async def _chat_loop(self):
         while True:
             try:
-                user_input = input("You: ")
-                if user_input.lower() in ['quit', 'exit']:
+                user_input = await self._read_input("You: ")
+
+                # Only the first word decides what to do, so we never
+                # lowercase (or copy) a long pasted message just to check it.
+                parts = user_input.split(None, 1)
+                cmd = parts[0].lower() if parts else ""
+                if cmd in ('quit', 'exit') and len(parts) == 1:
                     print("Agent: Goodbye!")
                     break
-                
-                # Clean input and process commands
-                clean_input = user_input.strip()
-                
-                if clean_input.lower().startswith("run_local "):
-                    file_path = clean_input.split(" ", 1)[1].strip()
-                    execution_result = self._execute_local_script(file_path)
-                    print(f"Agent: {execution_result}")
-                    
-                elif clean_input.lower().startswith("run_github "):
-                    url = clean_input.split(" ", 1)[1].strip()
-                    execution_result = self._execute_github_script(url)
+
+                handler = self._cmds.get(cmd) if len(parts) == 2 else None
+                if handler is not None:
+                    execution_result = await handler(parts[1].strip())
                     print(f"Agent: {execution_result}")
-                    
+
                 else:
-                    agent_response = self._get_agent_response(user_input)
-                    print(f"Agent: {agent_response}")
+                    # Print the reply as it is typed out; cached replies and
+                    # errors arrive all at once and are printed at the end.
+                    streamed = []
+                    def show_token(token):
+                        streamed.append(token)
+                        print(token, end="", flush=True)
+
+                    print("Agent: ", end="", flush=True)
+                    agent_response = await self._get_agent_response(user_input, on_token=show_token)
+                    if not streamed:
+                        print(agent_response)
+                    elif agent_response != "".join(streamed):
+                        print(f"\n{agent_response}")
+                    else:
+                        print()
                     
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, asyncio.CancelledError):
                 print("\nAgent: Goodbye!")
                 break
             except Exception as e:
@@ -196,7 +917,9 @@ if __name__ == "__main__":
     
     try:
         my_agent = PythonAgent(api_url=API_URL, api_key=API_KEY, system_prompt=SYSTEM_PROMPT)
-        my_agent.start_chat()
+        asyncio.run(my_agent.start_chat())
+    except KeyboardInterrupt:
+        print("\nAgent: Goodbye!")
     except ValueError as e:
         print(f"Configuration Error: {e}")
         print("Please make sure your .env file contains OPENAI_API_KEY=your_key_here")